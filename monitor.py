@@ -3,13 +3,19 @@ import os
 import time
 import argparse
 import csv
+import ctypes
+import errno
 import json
+import operator
+import platform
+import queue
+import struct
 import subprocess
 import sys
-from datetime import datetime
-from typing import List, Dict, Optional, Any
+import threading
+from itertools import compress, repeat
+from typing import List, Dict, Optional, Any, Callable, Tuple
 
-import psutil
 from loguru import logger
 
 try:
@@ -26,79 +32,419 @@ try:
         nvmlDeviceGetGraphicsRunningProcesses_v3,
         nvmlDeviceGetClockInfo,
         NVML_CLOCK_GRAPHICS,
+        NVML_ERROR_NOT_SUPPORTED,
+        NVMLError,
     )
 
     NVML_AVAILABLE = True
+    # Errors that may surface from a sample at runtime (device lost, EIO, ...)
+    SAMPLE_ERRORS: Tuple[type, ...] = (OSError, NVMLError)
 except Exception:
     NVML_AVAILABLE = False
+    SAMPLE_ERRORS = (OSError,)
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except Exception:
+    ORJSON_AVAILABLE = False
 
 RAPL_PATH = "/sys/class/powercap"
+PERF_POWER_PATH = "/sys/bus/event_source/devices/power"
+# Rows buffered between the sampler thread and the writer
+SAMPLE_QUEUE_SIZE = 1024
+OUTPUT_BUFFER_SIZE = 65536
+PROC_STAT_PATH = "/proc/stat"
+CPUFREQ_PATH = "/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq"
+CPUINFO_PATH = "/proc/cpuinfo"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+# NVML refresh-period probe: poll every SPACING s for up to WINDOW s / CHANGES changes
+UPDATE_PROBE_WINDOW = 0.25
+UPDATE_PROBE_SPACING = 0.002
+UPDATE_PROBE_CHANGES = 10
+# NVML refreshes power/utilization at most every ~100 ms; sampling slower than
+# this never hits the cache, so the probe is skipped
+NVML_MAX_REFRESH_PERIOD = 0.1
+# Re-read the per-GPU process list every N samples
+PROC_SCAN_EVERY = 5
+
+# Per-GPU columns, written as gpu<index>_<key>
+GPU_METRIC_KEYS = (
+    "power_w",
+    "gpu_util_percent",
+    "mem_util_percent",
+    "mem_used_mb",
+    "mem_total_mb",
+    "freq_mhz",
+)
+GPU_PROC_KEYS = ("gpu_proc_mem_used_mb",)
+PROC_KEYS = ("proc_cpu_percent", "proc_mem_rss_mb", "proc_ended")
+
+# perf_event_open syscall numbers (RAPL is only exposed on x86)
+PERF_EVENT_OPEN_NR = {"x86_64": 298, "i386": 336, "i686": 336}
 
+# perf "power" PMU event name -> powercap domain name, so column names
+# stay the same regardless of which backend is used.
+PERF_RAPL_EVENTS = {
+    "energy-pkg": "package",
+    "energy-cores": "core",
+    "energy-gpu": "uncore",
+    "energy-ram": "dram",
+    "energy-psys": "psys",
+}
+
+
+class FdHolder:
+    """Base for readers that keep one file descriptor open between samples."""
+
+    _fd: Optional[int] = None
+
+    def close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
 
-class RaplDomain:
+    def __del__(self):
+        self.close()
+
+
+class RaplDomain(FdHolder):
     def __init__(self, path: str, name: str):
         self.path = path
         self.name = name
         self.last_energy_uj: Optional[int] = None
-        self.last_timestamp: Optional[float] = None
+        self.last_timestamp: int = 0  # time.monotonic_ns()
+        # Keep the counter open for the lifetime of the domain so each sample
+        # is a single read instead of open/read/close. Raises OSError if it
+        # cannot be opened; see discover_rapl_domains().
+        self._fd = self._open()
 
-    def read_energy_uj(self) -> Optional[int]:
-        try:
-            with open(os.path.join(self.path, "energy_uj"), "r") as f:
-                return int(f.read().strip())
-        except PermissionError:
-            return None
-        except Exception:
-            return None
+    def _open(self) -> int:
+        return os.open(os.path.join(self.path, "energy_uj"), os.O_RDONLY)
+
+    def read_energy_uj(self) -> int:
+        return int(os.pread(self._fd, 32, 0))
 
     def sample_power_w(self) -> Optional[float]:
         energy = self.read_energy_uj()
-        now = time.time()
-        if energy is None:
-            return None
+        now_ns = time.monotonic_ns()
         if self.last_energy_uj is None:
             self.last_energy_uj = energy
-            self.last_timestamp = now
+            self.last_timestamp = now_ns
             return None
         delta_e = energy - self.last_energy_uj
-        delta_t = now - self.last_timestamp if self.last_timestamp else 0
+        delta_ns = now_ns - self.last_timestamp
         self.last_energy_uj = energy
-        self.last_timestamp = now
-        if delta_t <= 0:
+        self.last_timestamp = now_ns
+        if delta_ns <= 0:
             return None
-        return (delta_e / 1_000_000.0) / delta_t
+        # uJ / ns * 1000 = W; integer deltas, a single float division
+        return (delta_e * 1000) / delta_ns
 
 
-def discover_rapl_domains() -> List[RaplDomain]:
+class PerfEventAttr(ctypes.Structure):
+    # struct perf_event_attr up to PERF_ATTR_SIZE_VER5 (112 bytes)
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("size", ctypes.c_uint32),
+        ("config", ctypes.c_uint64),
+        ("sample_period", ctypes.c_uint64),
+        ("sample_type", ctypes.c_uint64),
+        ("read_format", ctypes.c_uint64),
+        ("flags", ctypes.c_uint64),
+        ("wakeup_events", ctypes.c_uint32),
+        ("bp_type", ctypes.c_uint32),
+        ("config1", ctypes.c_uint64),
+        ("config2", ctypes.c_uint64),
+        ("branch_sample_type", ctypes.c_uint64),
+        ("sample_regs_user", ctypes.c_uint64),
+        ("sample_stack_user", ctypes.c_uint32),
+        ("clockid", ctypes.c_int32),
+        ("sample_regs_intr", ctypes.c_uint64),
+        ("aux_watermark", ctypes.c_uint32),
+        ("sample_max_stack", ctypes.c_uint16),
+        ("reserved_2", ctypes.c_uint16),
+    ]
+
+
+_libc: Optional[ctypes.CDLL] = None
+
+
+def perf_event_open(attr: PerfEventAttr, pid: int, cpu: int) -> int:
+    """Call perf_event_open(2); raises OSError with the kernel errno on failure."""
+    global _libc
+    nr = PERF_EVENT_OPEN_NR.get(platform.machine())
+    if nr is None:
+        raise OSError(errno.ENOSYS, "perf_event_open not supported on this arch")
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.syscall.restype = ctypes.c_long
+    fd = _libc.syscall(
+        ctypes.c_long(nr),
+        ctypes.byref(attr),
+        ctypes.c_int(pid),
+        ctypes.c_int(cpu),
+        ctypes.c_int(-1),
+        ctypes.c_ulong(0),
+    )
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return fd
+
+
+class RaplPerfDomain(RaplDomain):
+    """RAPL domain read through the perf "power" PMU instead of powercap sysfs."""
+
+    def __init__(self, name: str, pmu_type: int, config: int, scale: float, cpu: int):
+        self.cpu = cpu
+        # counter units -> microjoules
+        self._scale_uj = scale * 1_000_000.0
+        self._attr = PerfEventAttr()
+        self._attr.type = pmu_type
+        self._attr.size = ctypes.sizeof(PerfEventAttr)
+        self._attr.config = config
+        super().__init__(PERF_POWER_PATH, name)
+
+    def _open(self) -> int:
+        return perf_event_open(self._attr, -1, self.cpu)
+
+    def read_energy_uj(self) -> int:
+        (count,) = struct.unpack("=Q", os.read(self._fd, 8))
+        return int(count * self._scale_uj)
+
+
+def _read_sysfs(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read().strip()
+
+
+def discover_rapl_perf_domains() -> List[RaplDomain]:
     domains: List[RaplDomain] = []
-    if not os.path.isdir(RAPL_PATH):
+    events_dir = os.path.join(PERF_POWER_PATH, "events")
+    if not os.path.isdir(events_dir):
+        return domains
+    try:
+        pmu_type = int(_read_sysfs(os.path.join(PERF_POWER_PATH, "type")))
+        cpus = parse_cpu_list(_read_sysfs(os.path.join(PERF_POWER_PATH, "cpumask")))
+    except Exception:
         return domains
-    for entry in os.listdir(RAPL_PATH):
-        if entry.startswith("intel-rapl"):
-            domain_path = os.path.join(RAPL_PATH, entry)
-            name_file = os.path.join(domain_path, "name")
-            name = entry
-            if os.path.isfile(name_file):
-                try:
-                    with open(name_file, "r") as f:
-                        name = f.read().strip()
-                except Exception:
-                    pass
-            domains.append(RaplDomain(domain_path, name))
+    for event, base_name in PERF_RAPL_EVENTS.items():
+        event_file = os.path.join(events_dir, event)
+        if not os.path.isfile(event_file):
+            continue
+        try:
+            # e.g. "event=0x02"
+            config = int(_read_sysfs(event_file).split("=", 1)[1], 0)
+            scale = float(_read_sysfs(event_file + ".scale"))
+        except Exception:
+            continue
+        for pkg, cpu in enumerate(cpus):
+            # Same names as powercap: only package domains carry the socket id
+            name = f"{base_name}-{pkg}" if event == "energy-pkg" else base_name
+            try:
+                domains.append(RaplPerfDomain(name, pmu_type, config, scale, cpu))
+            except OSError as e:
+                for d in domains:
+                    d.close()
+                logger.debug("perf_event_open({}) failed: {}", event, e)
+                return []
     return domains
 
 
+def parse_cpu_list(text: str) -> List[int]:
+    cpus: List[int] = []
+    for part in text.split(","):
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def discover_rapl_domains() -> List[RaplDomain]:
+    """Return RAPL domains that are open and readable.
+
+    All permission/availability handling happens here, once, so the
+    per-sample read path carries no error handling of its own.
+    """
+    # Prefer perf_event (one read of a counter fd per sample); fall back to
+    # powercap sysfs when perf is unavailable or not permitted.
+    domains: List[RaplDomain] = discover_rapl_perf_domains()
+    if domains:
+        return domains
+    try:
+        it = os.scandir(RAPL_PATH)
+    except OSError:
+        return domains
+    denied = 0
+    with it:
+        for entry in it:
+            if not entry.name.startswith("intel-rapl"):
+                continue
+            # Opening "name" directly replaces a separate isfile() stat
+            name = entry.name
+            try:
+                name = _read_sysfs(os.path.join(entry.path, "name"))
+            except OSError:
+                pass
+            try:
+                d = RaplDomain(entry.path, name)
+                d.read_energy_uj()
+            except PermissionError:
+                denied += 1
+                continue
+            except (OSError, ValueError):
+                # e.g. the "intel-rapl" control type directory has no energy_uj
+                continue
+            domains.append(d)
+    if not domains and denied:
+        logger.warning("RAPL domain detected but not readable (CPU power requires sudo)")
+        logger.info("Example: sudo uv run monitor.py")
+    return domains
+
+
+class CpuUsage(FdHolder):
+    """System-wide CPU utilization from the aggregate ``cpu`` line of /proc/stat."""
+
+    def __init__(self):
+        try:
+            self._fd = os.open(PROC_STAT_PATH, os.O_RDONLY)
+        except OSError:
+            self._fd = None
+        self.last_busy = 0
+        self.last_total = 0
+
+    def sample_percent(self) -> Optional[float]:
+        if self._fd is None:
+            return None
+        try:
+            line = os.pread(self._fd, 256, 0).split(b"\n", 1)[0]
+            # cpu user nice system idle iowait irq softirq steal [guest guest_nice]
+            # guest time is already included in user/nice, so skip it.
+            fields = [int(v) for v in line.split()[1:9]]
+        except Exception:
+            return None
+        total = sum(fields)
+        busy = total - fields[3] - fields[4]
+        delta_total = total - self.last_total
+        delta_busy = busy - self.last_busy
+        self.last_total = total
+        self.last_busy = busy
+        if delta_total <= 0:
+            return 0.0
+        return delta_busy / delta_total * 100.0
+
+
+class CpuFreq(FdHolder):
+    """Current CPU frequency (MHz) of cpu0 from cpufreq, or /proc/cpuinfo if absent."""
+
+    def __init__(self):
+        self.from_cpuinfo = False
+        try:
+            self._fd = os.open(CPUFREQ_PATH, os.O_RDONLY)
+        except OSError:
+            try:
+                self._fd = os.open(CPUINFO_PATH, os.O_RDONLY)
+                self.from_cpuinfo = True
+            except OSError:
+                self._fd = None
+
+    def sample_mhz(self) -> Optional[int]:
+        if self._fd is None:
+            return None
+        try:
+            if self.from_cpuinfo:
+                data = os.pread(self._fd, 4096, 0)
+                start = data.index(b"cpu MHz")
+                end = data.index(b"\n", start)
+                return int(round(float(data[start:end].split(b":", 1)[1])))
+            # scaling_cur_freq is in kHz; round to the nearest MHz
+            return (int(os.pread(self._fd, 32, 0)) + 500) // 1000
+        except Exception:
+            return None
+
+    @property
+    def available(self) -> bool:
+        return self._fd is not None
+
+
+class ProcessStat(FdHolder):
+    """CPU usage and RSS of one process from a single read of /proc/<pid>/stat."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._fd = os.open(f"/proc/{pid}/stat", os.O_RDONLY)
+        self.last_ticks: Optional[int] = None
+        self.last_timestamp: Optional[float] = None  # time.monotonic()
+
+    def sample(self) -> Optional[Tuple[float, float]]:
+        """Return ``(cpu_percent, rss_mb)``, or None once the process has exited.
+
+        cpu_percent follows psutil's Process.cpu_percent() (0.0 on the first call).
+        """
+        if self._fd is None:
+            return None
+        try:
+            data = os.pread(self._fd, 1024, 0)
+        except OSError:
+            # ESRCH once the process is gone (and reaped)
+            self.close()
+            return None
+        # comm (field 2) may contain spaces/parens; fields after it start at state
+        fields = data[data.rindex(b")") + 2 :].split()
+        if fields[0] in (b"Z", b"X"):
+            self.close()
+            return None
+        ticks = int(fields[11]) + int(fields[12])  # utime + stime
+        rss_mb = int(fields[21]) * PAGE_SIZE / (1024 * 1024)
+        now = time.monotonic()
+        cpu_pct = 0.0
+        if self.last_ticks is not None and now > self.last_timestamp:
+            cpu_time = (ticks - self.last_ticks) / CLK_TCK
+            cpu_pct = round(cpu_time / (now - self.last_timestamp) * 100.0, 1)
+        self.last_ticks = ticks
+        self.last_timestamp = now
+        return cpu_pct, rss_mb
+
+
 class GpuDevice:
     def __init__(self, index: int, handle: Any, name: str):
         self.index = index
         self.handle = handle
         self.name = name
+        # Firmware refresh periods (seconds) measured at init; 0 disables caching
+        self.power_period = 0.0
+        # Which NVML queries this device supports, probed once at init
+        self.supports_power = False
+        self.supports_util = False
+        self.supports_mem = False
+        self.supports_clock = False
+        self.util_period = 0.0
+        self.last_power_ts = 0.0
+        self.last_power: Optional[float] = None
+        self.last_util_ts = 0.0
+        self.last_util: Optional[Any] = None
+        self.proc_scan_tick = 0
+        self.last_proc_util: Optional[Dict[str, Any]] = None
+        # Queries whose runtime failure has already been warned about
+        self.warned: set = set()
 
 
-def init_nvml_devices() -> List[GpuDevice]:
+def init_nvml_devices(interval: float = 0.0) -> List[GpuDevice]:
+    """Open all NVIDIA GPUs and probe which queries each one supports."""
     devices: List[GpuDevice] = []
     if not NVML_AVAILABLE:
         return devices
+    probe_period = interval < NVML_MAX_REFRESH_PERIOD
     try:
         nvmlInit()
         count = nvmlDeviceGetCount()
@@ -109,62 +455,422 @@ def init_nvml_devices() -> List[GpuDevice]:
                 if isinstance(nvmlDeviceGetName(h), bytes)
                 else nvmlDeviceGetName(h)
             )
-            devices.append(GpuDevice(i, h, name))
+            dev = GpuDevice(i, h, name)
+            probe_gpu_capabilities(dev)
+            if probe_period and dev.supports_power:
+                dev.power_period = measure_update_period(lambda: read_gpu_power(dev))
+            if probe_period and dev.supports_util:
+                dev.util_period = measure_update_period(
+                    lambda: util_key(nvmlDeviceGetUtilizationRates(dev.handle))
+                )
+            devices.append(dev)
     except Exception:
         return []
     return devices
 
 
-def sample_gpu_power(dev: GpuDevice) -> Optional[float]:
+def probe_gpu_capabilities(dev: GpuDevice):
+    dev.supports_power = nvml_supported(lambda: read_gpu_power(dev))
+    dev.supports_util = nvml_supported(
+        lambda: nvmlDeviceGetUtilizationRates(dev.handle)
+    )
+    dev.supports_mem = nvml_supported(lambda: nvmlDeviceGetMemoryInfo(dev.handle))
+    dev.supports_clock = nvml_supported(
+        lambda: nvmlDeviceGetClockInfo(dev.handle, NVML_CLOCK_GRAPHICS)
+    )
+
+
+def handle_gpu_error(dev: GpuDevice, query: str, err: Exception):
+    """Drop ``query`` for good only if NVML reports it unsupported."""
+    if getattr(err, "value", None) == NVML_ERROR_NOT_SUPPORTED:
+        setattr(dev, f"supports_{query}", False)
+        logger.warning("GPU {} {} not supported; disabled", dev.index, query)
+    elif query in dev.warned:
+        logger.debug("GPU {} {} sampling failed: {}", dev.index, query, err)
+    else:
+        # Transient errors only blank this tick's cell; warn once per query
+        dev.warned.add(query)
+        logger.warning("GPU {} {} sampling failed: {}", dev.index, query, err)
+
+
+def nvml_supported(call: Callable[[], Any]) -> bool:
+    # A query that "succeeds" with no value would leave its column blank forever
     try:
-        return nvmlDeviceGetPowerUsage(dev.handle) / 1000.0
+        return call() is not None
     except Exception:
-        return None
+        return False
+
 
+def util_key(util: Any) -> Tuple[int, int]:
+    return (util.gpu, util.memory)
 
-def sample_gpu_util(dev: GpuDevice) -> Dict[str, Any]:
-    data: Dict[str, Any] = {}
+
+def measure_update_period(read: Callable[[], Any]) -> float:
+    """Shortest gap (s) between distinct values of ``read``, or 0.0 if unknown."""
     try:
-        util = nvmlDeviceGetUtilizationRates(dev.handle)
-        mem = nvmlDeviceGetMemoryInfo(dev.handle)
-        data["gpu_util_percent"] = util.gpu
-        data["mem_util_percent"] = util.memory
-        data["mem_used_mb"] = mem.used / (1024 * 1024)
-        data["mem_total_mb"] = mem.total / (1024 * 1024)
-        return data
+        last = read()
     except Exception:
-        return data
+        return 0.0
+    last_change: Optional[float] = None
+    period = 0.0
+    changes = 0
+    end = time.monotonic() + UPDATE_PROBE_WINDOW
+    while changes < UPDATE_PROBE_CHANGES and time.monotonic() < end:
+        time.sleep(UPDATE_PROBE_SPACING)
+        try:
+            value = read()
+        except Exception:
+            return 0.0
+        if value == last:
+            continue
+        now = time.monotonic()
+        if last_change is not None:
+            gap = now - last_change
+            period = gap if period == 0.0 else min(period, gap)
+        last_change = now
+        last = value
+        changes += 1
+    return period
+
+
+def read_gpu_power(dev: GpuDevice) -> float:
+    return nvmlDeviceGetPowerUsage(dev.handle) / 1000.0
+
+
+def sample_gpu_metrics(dev: GpuDevice) -> List[Any]:
+    """Return one value per GPU_METRIC_KEYS entry (None if unavailable).
+
+    Power and utilization are reused until the device's refresh period elapses.
+    """
+    power_w = gpu_util = mem_util = mem_used = mem_total = freq = None
+    now = time.monotonic()
+    if dev.supports_power:
+        try:
+            if now - dev.last_power_ts >= dev.power_period * 0.9:
+                dev.last_power = read_gpu_power(dev)
+                dev.last_power_ts = now
+            power_w = round(dev.last_power, 1)
+        except SAMPLE_ERRORS as e:
+            handle_gpu_error(dev, "power", e)
+    if dev.supports_util:
+        try:
+            if now - dev.last_util_ts >= dev.util_period * 0.9:
+                dev.last_util = nvmlDeviceGetUtilizationRates(dev.handle)
+                dev.last_util_ts = now
+            gpu_util = dev.last_util.gpu
+            mem_util = dev.last_util.memory
+        except SAMPLE_ERRORS as e:
+            handle_gpu_error(dev, "util", e)
+    if dev.supports_mem:
+        try:
+            mem = nvmlDeviceGetMemoryInfo(dev.handle)
+            mem_used = mem.used / (1024 * 1024)
+            mem_total = mem.total / (1024 * 1024)
+        except SAMPLE_ERRORS as e:
+            handle_gpu_error(dev, "mem", e)
+    if dev.supports_clock:
+        try:
+            freq = nvmlDeviceGetClockInfo(dev.handle, NVML_CLOCK_GRAPHICS)
+        except SAMPLE_ERRORS as e:
+            handle_gpu_error(dev, "clock", e)
+    return [power_w, gpu_util, mem_util, mem_used, mem_total, freq]
 
 
 def sample_gpu_process_util(
     dev: GpuDevice, target_pid: int
 ) -> Optional[Dict[str, Any]]:
+    # The monitored PID is fixed, so the process list only needs refreshing
+    # every PROC_SCAN_EVERY ticks; in between, reuse the last result.
+    tick = dev.proc_scan_tick
+    dev.proc_scan_tick = tick + 1
+    if tick % PROC_SCAN_EVERY:
+        return dev.last_proc_util
+    dev.last_proc_util = None
     try:
         procs = nvmlDeviceGetGraphicsRunningProcesses_v3(dev.handle)
-        for p in procs:
-            if p.pid == target_pid:
-                return {"gpu_proc_mem_used_mb": p.usedGpuMemory / (1024 * 1024)}
+        proc_map = {p.pid: p for p in procs}
+        p = proc_map.get(target_pid)
+        if p is not None:
+            dev.last_proc_util = {
+                "gpu_proc_mem_used_mb": p.usedGpuMemory / (1024 * 1024)
+            }
     except Exception:
         return None
-    return None
+    return dev.last_proc_util
+
+
+def write_csv_header(writer: csv.writer, keys: List[str]):
+    writer.writerow(keys)
+
+
+def build_columns(
+    rapl_domains: List[RaplDomain],
+    gpu_devices: List[GpuDevice],
+    cpu_freq: CpuFreq,
+    track_process: bool,
+) -> List[str]:
+    """Fixed output schema; each sample is a list with one slot per column."""
+    columns = ["timestamp", "datetime", "cpu_usage_percent"]
+    if cpu_freq.available:
+        columns.append("cpu_freq_mhz")
+    for d in rapl_domains:
+        key = f"cpu_{d.name}_power_w"
+        if key not in columns:
+            columns.append(key)
+    for g in gpu_devices:
+        columns.extend(f"gpu{g.index}_{k}" for k in GPU_METRIC_KEYS)
+        if track_process:
+            columns.extend(f"gpu{g.index}_{k}" for k in GPU_PROC_KEYS)
+    if track_process:
+        columns.extend(PROC_KEYS)
+    return columns
 
 
-def sample_gpu_frequency(dev: GpuDevice) -> Optional[int]:
+def compile_tick(
+    columns: List[str],
+    rapl_domains: List[RaplDomain],
+    gpu_devices: List[GpuDevice],
+    cpu_usage: CpuUsage,
+    cpu_freq: CpuFreq,
+) -> Callable[[List[Any], Optional[int]], None]:
+    """Generate a ``tick(row, pid)`` with device list and column indices baked in."""
+    col = {k: i for i, k in enumerate(columns)}
+    warned = set()
+
+    def failed(label: str, err: Exception):
+        # Warn once per source; repeats would flood stderr every tick
+        if label in warned:
+            logger.debug("{} sampling failed: {}", label, err)
+        else:
+            warned.add(label)
+            logger.warning("{} sampling failed: {}", label, err)
+
+    env: Dict[str, Any] = {
+        "_cpu_pct": cpu_usage.sample_percent,
+        "_cpu_freq": cpu_freq.sample_mhz,
+        "_gpu_metrics": sample_gpu_metrics,
+        "_gpu_proc_util": sample_gpu_process_util,
+        "_failed": failed,
+        "_errors": SAMPLE_ERRORS,
+    }
+    body = [
+        "v = _cpu_pct()",
+        "if v is not None:",
+        f"    row[{col['cpu_usage_percent']}] = round(v, 1)",
+    ]
+    if "cpu_freq_mhz" in col:
+        body.append(f"row[{col['cpu_freq_mhz']}] = _cpu_freq()")
+    for n, d in enumerate(rapl_domains):
+        env[f"_rapl{n}"] = d.sample_power_w
+        # Each device is its own try block so one failure (EIO, NVMLError)
+        # does not blank the columns of the others.
+        body += [
+            "try:",
+            f"    v = _rapl{n}()",
+            "    if v is not None:",
+            f"        row[{col[f'cpu_{d.name}_power_w']}] = round(v, 3)",
+            "except _errors as e:",
+            f"    _failed({f'RAPL {d.name}'!r}, e)",
+        ]
+    for n, g in enumerate(gpu_devices):
+        env[f"_g{n}"] = g
+        start = col[f"gpu{g.index}_{GPU_METRIC_KEYS[0]}"]
+        end = start + len(GPU_METRIC_KEYS)
+        # Errors are handled per query inside _gpu_metrics
+        body.append(f"row[{start}:{end}] = _gpu_metrics(_g{n})")
+        proc_cols = [
+            (k, col[f"gpu{g.index}_{k}"])
+            for k in GPU_PROC_KEYS
+            if f"gpu{g.index}_{k}" in col
+        ]
+        if proc_cols:
+            body += [
+                "if pid is not None:",
+                f"    p = _gpu_proc_util(_g{n}, pid)",
+                "    if p:",
+            ]
+            body += [f"        row[{i}] = p[{k!r}]" for k, i in proc_cols]
+    names = sorted(env)
+    src = "\n".join(
+        [f"def _make({', '.join(names)}):", "    def _tick(row, pid):"]
+        + ["        " + line for line in body]
+        + ["    return _tick"]
+    )
+    logger.debug("Generated tick function:\n{}", src)
+    ns: Dict[str, Any] = {}
+    exec(compile(src, "<tick>", "exec"), ns)
+    return ns["_make"](*(env[n] for n in names))
+
+
+class RowWriter:
+    """Write sample rows (lists ordered like ``columns``; None = no value)."""
+
+    def __init__(
+        self,
+        fmt: str,
+        file_handle: Optional[Any],
+        columns: List[str],
+        fsync_interval: int = 0,
+    ):
+        self.fmt = fmt
+        self.file_handle = file_handle
+        self.columns = columns
+        self.fsync_interval = fsync_interval if file_handle else 0
+        self.rows_since_sync = 0
+        self.csv_writer = (
+            csv.writer(file_handle or sys.stdout, lineterminator="\n")
+            if fmt == "csv"
+            else None
+        )
+        self.header_printed = False
+        # JSONL rows are built into one dict reused across rows
+        self._row: Dict[str, Any] = {}
+        # orjson produces bytes, so the output must be a binary stream
+        self.binary = fmt == "jsonl" and ORJSON_AVAILABLE
+        if self.binary and not file_handle:
+            self._out = sys.stdout.buffer
+            self._flush = sys.stdout.isatty()
+
+    def write(self, values: List[Any]):
+        if self.csv_writer:
+            if not self.header_printed:
+                if self.file_handle:
+                    write_csv_header(self.csv_writer, self.columns)
+                else:
+                    # stdout header is marked as a comment line
+                    write_csv_header(
+                        self.csv_writer,
+                        ["#" + self.columns[0]] + self.columns[1:],
+                    )
+                self.header_printed = True
+            # csv.writer renders None as an empty cell
+            self.csv_writer.writerow(values)
+        else:
+            # Drop missing (None) values with C-level iterators rather than a
+            # per-key comprehension; keys keep column order.
+            row = self._row
+            row.clear()
+            row.update(
+                compress(
+                    zip(self.columns, values),
+                    map(operator.is_not, values, repeat(None)),
+                )
+            )
+            if self.binary:  # jsonl via orjson
+                data = orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+                if self.file_handle:
+                    self.file_handle.write(data)
+                else:
+                    self._out.write(data)
+                    if self._flush:
+                        self._out.flush()
+            elif self.file_handle:
+                self.file_handle.write(json.dumps(row, ensure_ascii=False) + "\n")
+            else:
+                print(json.dumps(row, ensure_ascii=False))
+        if self.fsync_interval:
+            self.rows_since_sync += 1
+            if self.rows_since_sync >= self.fsync_interval:
+                self.sync()
+
+    def sync(self):
+        self.rows_since_sync = 0
+        self.file_handle.flush()
+        os.fsync(self.file_handle.fileno())
+
+
+def sampler_thread(
+    stop_evt: threading.Event,
+    q: "queue.Queue[Optional[List[Any]]]",
+    args: argparse.Namespace,
+    columns: List[str],
+    rapl_domains: List[RaplDomain],
+    gpu_devices: List[GpuDevice],
+    target_process: Optional[ProcessStat],
+    popen: Optional[subprocess.Popen],
+    cpu_usage: CpuUsage,
+    cpu_freq: CpuFreq,
+):
+    """Take samples on a fixed cadence and hand rows to the writer via ``q``.
+
+    Only NVML/RAPL/procfs reads happen here; formatting and I/O stay on the
+    consumer side so they cannot delay the next sample. A ``None`` row is
+    always queued on exit to tell the consumer to stop.
+    """
     try:
-        freq = nvmlDeviceGetClockInfo(dev.handle, NVML_CLOCK_GRAPHICS)
-        return freq
-    except Exception:
-        return None
+        start_time = time.monotonic()
+        cpu_usage.sample_percent()
+        for d in rapl_domains:
+            d.sample_power_w()
 
+        # Bind hot callables to locals so the loop uses LOAD_FAST instead of
+        # global + attribute lookups on every sample.
+        time_time = time.time
+        time_monotonic = time.monotonic
+        time_strftime = time.strftime
+        time_localtime = time.localtime
+        stop_wait = stop_evt.wait
+        q_put = q.put
+        tick = compile_tick(columns, rapl_domains, gpu_devices, cpu_usage, cpu_freq)
 
-def format_row(row: Dict[str, Any], fmt: str) -> str:
-    if fmt == "jsonl":
-        return json.dumps(row, ensure_ascii=False)
-    return ",".join(str(row.get(k, "")) for k in row.keys())
+        # Each tick copies a template row and assigns by column index instead
+        # of building a dict.
+        col = {k: i for i, k in enumerate(columns)}
+        blank: List[Any] = [None] * len(columns)
+        i_proc_cpu = col.get("proc_cpu_percent")
+        i_proc_rss = col.get("proc_mem_rss_mb")
+        i_proc_ended = col.get("proc_ended")
+
+        # Absolute deadlines keep the cadence fixed regardless of how long a
+        # sample takes; on overrun we resync instead of bursting to catch up.
+        deadline = time_monotonic()
+        last_int_ts = 0
+        last_date_str = ""
+        while not stop_evt.is_set():
+            ts = time_time()
+            elapsed = time_monotonic() - start_time
+            if args.duration and elapsed >= args.duration:
+                break
+            # The seconds part only changes once per second, so format it once
+            # and append the milliseconds.
+            int_ts = int(ts)
+            if int_ts != last_int_ts:
+                last_date_str = time_strftime(
+                    "%Y-%m-%d %H:%M:%S", time_localtime(int_ts)
+                )
+                last_int_ts = int_ts
+            row = blank.copy()
+            row[0] = ts
+            row[1] = f"{last_date_str}.{int((ts - int_ts) * 1000):03d}"
+            tick(row, target_process.pid if target_process else None)
+            if target_process:
+                stat = target_process.sample()
+                if stat is None:
+                    row[i_proc_ended] = True
+                    target_process = None
+                else:
+                    row[i_proc_cpu], row[i_proc_rss] = stat
+            try:
+                q_put(row, block=False)
+            except queue.Full:
+                logger.debug("Sample queue full, dropping sample at {:.3f}", ts)
 
+            if popen and popen.poll() is not None and not target_process:
+                # command finished
+                break
 
-def write_csv_header(writer: csv.writer, keys: List[str]):
-    writer.writerow(keys)
+            deadline += args.interval
+            sleep_for = deadline - time_monotonic()
+            if sleep_for > 0:
+                stop_wait(sleep_for)
+            else:
+                deadline = time_monotonic()
+    finally:
+        stop_evt.set()
+        try:
+            q.put(None, timeout=1.0)
+        except queue.Full:
+            pass
 
 
 def run_command(command: List[str]) -> subprocess.Popen:
@@ -190,6 +896,12 @@ def build_arg_parser() -> argparse.ArgumentParser:
     p.add_argument(
         "--format", choices=["csv", "jsonl"], default="csv", help="Output format"
     )
+    p.add_argument(
+        "--fsync-interval",
+        type=int,
+        default=0,
+        help="Flush and fsync the output file every N rows (0=only on exit)",
+    )
     p.add_argument(
         "--command",
         type=str,
@@ -212,6 +924,9 @@ def build_arg_parser() -> argparse.ArgumentParser:
         choices=["TRACE", "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR", "CRITICAL"],
         help="Log level",
     )
+    p.add_argument(
+        "--log-file", type=str, default="", help="Also write logs to this file"
+    )
     return p
 
 
@@ -221,13 +936,25 @@ def main():
 
     # Logger setup
     logger.remove()
-    logger.add(sys.stderr, level=args.log_level, enqueue=True, colorize=True)
+    logger.add(
+        sys.stderr,
+        level=args.log_level,
+        enqueue=False,
+        colorize=sys.stderr.isatty(),
+        format="{time:HH:mm:ss} {level} {message}",
+    )
+    if args.log_file:
+        logger.add(args.log_file, level=args.log_level, enqueue=True)
     logger.info("Start interval={:.3f}s format={}", args.interval, args.format)
 
     rapl_domains = discover_rapl_domains() if not args.no_cpu else []
-    gpu_devices = init_nvml_devices() if (not args.no_gpu and NVML_AVAILABLE) else []
+    gpu_devices = (
+        init_nvml_devices(args.interval)
+        if (not args.no_gpu and NVML_AVAILABLE)
+        else []
+    )
 
-    target_process: Optional[psutil.Process] = None
+    target_process: Optional[ProcessStat] = None
     popen: Optional[subprocess.Popen] = None
     if args.command:
         # Strip leading -- if present in REMAINDER
@@ -238,39 +965,22 @@ def main():
             logger.error("External command is not specified")
             return
         popen = run_command(cmd)
-        target_process = psutil.Process(popen.pid)
+        target_process = ProcessStat(popen.pid)
     elif args.pid:
         try:
-            target_process = psutil.Process(args.pid)
+            target_process = ProcessStat(args.pid)
         except Exception:
             logger.error("Cannot access PID {}", args.pid)
 
-    start_time = time.time()
-    csv_writer = None
     file_handle = None
-    keys_order: List[str] = []
-
     if args.output:
-        mode = "w"
-        file_handle = open(args.output, mode, buffering=1)
-        if args.format == "csv":
-            csv_writer = csv.writer(file_handle)
+        # Fully buffered: rows are flushed in OUTPUT_BUFFER_SIZE chunks (or
+        # every --fsync-interval rows) rather than one write(2) per sample.
+        mode = "wb" if args.format == "jsonl" and ORJSON_AVAILABLE else "w"
+        file_handle = open(args.output, mode, buffering=OUTPUT_BUFFER_SIZE)
 
     if rapl_domains:
-        accessible_domains = []
-        for d in rapl_domains:
-            e = d.read_energy_uj()
-            if e is not None:
-                accessible_domains.append(d)
-        if accessible_domains:
-            logger.info(
-                "RAPL domains: {}", ", ".join(d.name for d in accessible_domains)
-            )
-            rapl_domains = accessible_domains
-        else:
-            logger.warning("RAPL domain detected but not readable (CPU power requires sudo)")
-            logger.info("Example: sudo uv run monitor.py")
-            rapl_domains = []
+        logger.info("RAPL domains: {}", ", ".join(d.name for d in rapl_domains))
     if gpu_devices:
         try:
             drv = nvmlSystemGetDriverVersion().decode()
@@ -284,84 +994,63 @@ def main():
     elif not args.no_gpu and not NVML_AVAILABLE:
         logger.warning("pynvml is not available, GPU monitoring disabled")
 
-    header_printed = False
-    for d in rapl_domains:
-        d.sample_power_w()
+    cpu_usage = CpuUsage()
+    cpu_freq = CpuFreq()
+    columns = build_columns(
+        rapl_domains, gpu_devices, cpu_freq, target_process is not None
+    )
 
+    stop_evt = threading.Event()
+    q: "queue.Queue[Optional[List[Any]]]" = queue.Queue(maxsize=SAMPLE_QUEUE_SIZE)
+    sampler = threading.Thread(
+        target=sampler_thread,
+        args=(
+            stop_evt,
+            q,
+            args,
+            columns,
+            rapl_domains,
+            gpu_devices,
+            target_process,
+            popen,
+            cpu_usage,
+            cpu_freq,
+        ),
+        name="sampler",
+        daemon=True,
+    )
+    writer = RowWriter(args.format, file_handle, columns, args.fsync_interval)
+
+    sampler.start()
     try:
         while True:
-            ts = time.time()
-            elapsed = ts - start_time
-            if args.duration and elapsed >= args.duration:
-                break
-            row: Dict[str, Any] = {
-                "timestamp": ts,
-                "datetime": datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S.%f")[
-                    :-3
-                ],
-            }
-            # System-wide CPU metrics
-            row["cpu_usage_percent"] = round(psutil.cpu_percent(interval=None), 1)
-            cpu_freq = psutil.cpu_freq()
-            if cpu_freq is not None:
-                row["cpu_freq_mhz"] = int(round(cpu_freq.current))
-            for d in rapl_domains:
-                pw = d.sample_power_w()
-                if pw is not None:
-                    row[f"cpu_{d.name}_power_w"] = round(pw, 3)
-            for g in gpu_devices:
-                gpw = sample_gpu_power(g)
-                if gpw is not None:
-                    row[f"gpu{g.index}_power_w"] = round(gpw, 1)
-                util = sample_gpu_util(g)
-                for k, v in util.items():
-                    row[f"gpu{g.index}_{k}"] = v
-                gpu_freq = sample_gpu_frequency(g)
-                if gpu_freq is not None:
-                    row[f"gpu{g.index}_freq_mhz"] = gpu_freq
-                if target_process:
-                    proc_util = sample_gpu_process_util(g, target_process.pid)
-                    if proc_util:
-                        for k, v in proc_util.items():
-                            row[f"gpu{g.index}_{k}"] = v
-            if target_process:
-                try:
-                    cpu_pct = target_process.cpu_percent(interval=None)
-                    mem_info = target_process.memory_info()
-                    row["proc_cpu_percent"] = cpu_pct
-                    row["proc_mem_rss_mb"] = mem_info.rss / (1024 * 1024)
-                except Exception:
-                    row["proc_ended"] = True
-                    target_process = None
-            if args.format == "csv":
-                if not header_printed:
-                    keys_order = list(row.keys())
-                    if csv_writer:
-                        write_csv_header(csv_writer, keys_order)
-                    else:
-                        print("#" + ",".join(keys_order))
-                    header_printed = True
-                line_values = [row.get(k, "") for k in keys_order]
-                line = ",".join(str(v) for v in line_values)
-                if file_handle:
-                    file_handle.write(line + "\n")
-                else:
-                    print(line)
-            else:  # jsonl
-                if file_handle:
-                    file_handle.write(json.dumps(row, ensure_ascii=False) + "\n")
-                else:
-                    print(json.dumps(row, ensure_ascii=False))
-
-            if popen and popen.poll() is not None and not target_process:
-                # command finished
+            row = q.get()
+            if row is None:
                 break
-
-            time.sleep(args.interval)
+            writer.write(row)
     except KeyboardInterrupt:
-        pass
+        stop_evt.set()
+        sampler.join()
+        # Write out the samples still queued so none taken are lost
+        while True:
+            try:
+                row = q.get_nowait()
+            except queue.Empty:
+                break
+            if row is None:
+                break
+            writer.write(row)
+        if file_handle:
+            file_handle.flush()
     finally:
+        stop_evt.set()
+        sampler.join()
+        for d in rapl_domains:
+            d.close()
+        cpu_usage.close()
+        cpu_freq.close()
         if file_handle:
+            file_handle.flush()
             file_handle.close()
         if NVML_AVAILABLE:
             try: